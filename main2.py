@@ -1,10 +1,23 @@
 import sqlite3
 import requests
-import datetime
-import random
-import math
+import collections
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import tkinter as tk
 from tkinter import messagebox
+import matplotlib
+from matplotlib.collections import LineCollection
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
@@ -12,9 +25,62 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 # Data & Simulation Functions (Core)    #
 #########################################
 
+_DB_PATH = "portfolio.db"
+
+# Single shared connection, opened once instead of per call
+_CONN = sqlite3.connect(_DB_PATH, check_same_thread=False)
+_CONN.executescript("""
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-65536;
+""")
+# Serializes write transactions on _CONN when fetches run in parallel
+_DB_LOCK = threading.Lock()
+
+# Shared HTTP session so fetches reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "Mozilla/5.0", "Accept-Encoding": "gzip"})
+
+# Recent simulation results keyed on (symbol, days, simulations, db mtime); cleared when new data is stored
+_SIM_CACHE = collections.OrderedDict()
+_SIM_CACHE_SIZE = 16
+# Simulations run on worker threads, so lookups, eviction and clearing go through this lock
+_SIM_CACHE_LOCK = threading.Lock()
+
+# Rows per multi-row INSERT (5 parameters each, well under SQLite's 999 limit)
+_INSERT_BATCH = 50
+# Upsert so a re-fetched bar (e.g. today's still-moving close) overwrites the stored one;
+# rows whose values did not change are left alone and not counted
+_INSERT_SQL = """
+INSERT INTO stocks (symbol, date, open_price, close_price, volume) VALUES {}
+ON CONFLICT(symbol, date) DO UPDATE SET
+    open_price = excluded.open_price, close_price = excluded.close_price, volume = excluded.volume
+WHERE stocks.open_price IS NOT excluded.open_price
+    OR stocks.close_price IS NOT excluded.close_price
+    OR stocks.volume IS NOT excluded.volume
+"""
+
+if njit is not None:
+    # Per-step kernel; every path is independent so the outer loop runs across all cores
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _mc_kernel(last_close_price, avg_return, volatility, days, simulations):
+        paths = np.empty((simulations, days + 1), dtype=np.float32)
+        for i in prange(simulations):
+            price = last_close_price
+            paths[i, 0] = price
+            for t in range(1, days + 1):
+                price *= 1.0 + avg_return + volatility * np.random.normal()
+                paths[i, t] = price
+        return paths
+else:
+    _mc_kernel = None
+# Numba's fallback workqueue threading layer aborts on concurrent use, so only one
+# Python thread runs the kernel at a time (prange still spreads each call across cores)
+_KERNEL_LOCK = threading.Lock()
+
 def create_database():
-    conn = sqlite3.connect("portfolio.db")
-    cursor = conn.cursor()
+    cursor = _CONN.cursor()
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS stocks (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -25,80 +91,143 @@ def create_database():
         volume REAL
     )
     """)
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_stocks_symbol_date_unique'")
+    if cursor.fetchone() is None:
+        # Older databases may carry a plain (symbol, date) index; the unique one replaces it
+        cursor.execute("DROP INDEX IF EXISTS idx_stocks_symbol_date")
+        # Drop rows duplicated by earlier launches so the unique index can be built
+        cursor.execute("DELETE FROM stocks WHERE id NOT IN (SELECT MIN(id) FROM stocks GROUP BY symbol, date)")
+        cursor.execute("CREATE UNIQUE INDEX idx_stocks_symbol_date_unique ON stocks(symbol, date)")
+    _CONN.commit()
 
 def fetch_stock_data(symbol):
     url = f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}?interval=1d&range=5mo"
-    headers = {"User-Agent": "Mozilla/5.0"}
     try: 
-        response = requests.get(url, headers=headers)
+        response = _SESSION.get(url, timeout=10)
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content) if orjson is not None else response.json()
         if "chart" in data and "result" in data["chart"]:
             result = data["chart"]["result"][0]
-            timestamps = result.get("timestamp", [])
             indicators = result.get("indicators", {}).get("quote", [{}])[0]
-            conn = sqlite3.connect("portfolio.db")
-            cursor = conn.cursor()
-            for i in range(len(timestamps)):
-                date = datetime.datetime.fromtimestamp(timestamps[i]).strftime('%Y-%m-%d')
-                open_price = indicators.get("open", [None])[i]
-                close_price = indicators.get("close", [None])[i]
-                volume = indicators.get("volume", [None])[i]
-                if open_price is not None and close_price is not None and volume is not None:
-                    cursor.execute("""
-                    INSERT INTO stocks (symbol, date, open_price, close_price, volume)
-                    VALUES (?, ?, ?, ?, ?)
-                    """, (symbol, date, open_price, close_price, volume))
-            conn.commit()
-            conn.close()
+            # Missing values arrive as None and become NaN in the float arrays
+            timestamps = np.asarray(result.get("timestamp", []), dtype=np.int64)
+            opens = np.asarray(indicators.get("open", []), dtype=np.float64)
+            closes = np.asarray(indicators.get("close", []), dtype=np.float64)
+            volumes = np.asarray(indicators.get("volume", []), dtype=np.float64)
+            n = min(timestamps.size, opens.size, closes.size, volumes.size)
+            timestamps, opens, closes, volumes = timestamps[:n], opens[:n], closes[:n], volumes[:n]
+            valid = np.isfinite(opens) & np.isfinite(closes) & np.isfinite(volumes)
+            # Epoch seconds -> 'YYYY-MM-DD' strings in one datetime64 cast
+            dates = timestamps[valid].astype("datetime64[s]").astype("datetime64[D]").astype(str)
+            rows = [(symbol, date, o, c, v)
+                    for date, o, c, v in zip(dates.tolist(), opens[valid].tolist(),
+                                             closes[valid].tolist(), volumes[valid].tolist())]
+            # One transaction for the whole batch; full chunks go in as one multi-row INSERT each
+            full = len(rows) - len(rows) % _INSERT_BATCH
+            batch_sql = _INSERT_SQL.format(", ".join(["(?, ?, ?, ?, ?)"] * _INSERT_BATCH))
+            changed = 0
+            with _DB_LOCK, _CONN:
+                for start in range(0, full, _INSERT_BATCH):
+                    chunk = rows[start:start + _INSERT_BATCH]
+                    changed += _CONN.execute(batch_sql, [value for row in chunk for value in row]).rowcount
+                if full < len(rows):
+                    changed += _CONN.executemany(_INSERT_SQL.format("(?, ?, ?, ?, ?)"), rows[full:]).rowcount
+            if changed > 0:
+                _returns.cache_clear()
+                with _SIM_CACHE_LOCK:
+                    _SIM_CACHE.clear()
             print(f"Stock data for {symbol} stored in database.")
         else:
             print("Invalid data format received from Yahoo Finance.")
     except Exception as e:
         print(f"Error fetching data for {symbol}: {e}")
 
-def get_daily_returns(symbol):
-    conn = sqlite3.connect("portfolio.db")
-    cursor = conn.cursor()
+def _db_mtime():
+    # WAL commits land in the -wal file until a checkpoint, so watch both files
+    mtimes = []
+    for path in (_DB_PATH, _DB_PATH + "-wal"):
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(0)
+    return tuple(mtimes)
+
+@functools.lru_cache(maxsize=32)
+def _returns(symbol, mtime):
+    cursor = _CONN.cursor()
     cursor.execute("SELECT date, close_price FROM stocks WHERE symbol = ? ORDER BY date", (symbol,))
     rows = cursor.fetchall()
-    conn.close()
     if len(rows) < 2:
         print("Not enough data for simulation.")
         return None
-    returns = [(rows[i][1] - rows[i-1][1]) / rows[i-1][1] for i in range(1, len(rows))]
+    closes = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+    returns = np.diff(closes) / closes[:-1]
     return returns
 
-def monte_carlo_simulation(symbol, days=30, simulations=1000):
+def get_daily_returns(symbol):
+    # Cached per symbol until the database files change on disk
+    return _returns(symbol, _db_mtime())
+
+def _simulation_inputs(symbol):
     returns = get_daily_returns(symbol)
-    if not returns:
+    if returns is None:
         return None
-    avg_return = sum(returns) / len(returns)
-    volatility = (max(returns) - min(returns)) / 2
-    conn = sqlite3.connect("portfolio.db")
-    cursor = conn.cursor()
+    cursor = _CONN.cursor()
     cursor.execute("SELECT close_price FROM stocks WHERE symbol = ? ORDER BY date DESC LIMIT 1", (symbol,))
     last_close_price = cursor.fetchone()[0]
-    conn.close()
-    simulations_result = []
-    for _ in range(simulations):
-        price = last_close_price
-        path = [price]
-        for _ in range(days):
-            random_factor = random.gauss(avg_return, volatility)
-            price *= (1 + random_factor)
-            path.append(price)
-        simulations_result.append(path)
-    return simulations_result
+    return last_close_price, returns.mean(), returns.std()
+
+def monte_carlo_simulation(symbol, days=30, simulations=1000):
+    if simulations < 1 or days < 0:
+        print("Simulations must be at least 1 and days cannot be negative.")
+        return None
+    key = (symbol, days, simulations, _db_mtime())
+    with _SIM_CACHE_LOCK:
+        cached = _SIM_CACHE.get(key)
+    if cached is not None:
+        return cached
+    inputs = _simulation_inputs(symbol)
+    if inputs is None:
+        return None
+    last_close_price, avg_return, volatility = inputs
+    if _mc_kernel is not None:
+        with _KERNEL_LOCK:
+            paths = _mc_kernel(float(last_close_price), float(avg_return), float(volatility), days, simulations)
+    else:
+        # Each row is one simulated path; column 0 holds the starting price.
+        # float32 is plenty for plotting and halves memory traffic.
+        paths = np.empty((simulations, days + 1), dtype=np.float32)
+        paths[:, 0] = last_close_price
+        random_factors = np.random.default_rng().standard_normal((simulations, days), dtype=np.float32)
+        random_factors *= volatility
+        random_factors += 1.0 + avg_return
+        np.cumprod(random_factors, axis=1, out=paths[:, 1:])
+        paths[:, 1:] *= last_close_price
+    with _SIM_CACHE_LOCK:
+        if len(_SIM_CACHE) >= _SIM_CACHE_SIZE:
+            _SIM_CACHE.popitem(last=False)
+        _SIM_CACHE[key] = paths
+    return paths
+
+def monte_carlo_final_only(symbol, days=30, simulations=1000):
+    if simulations < 1 or days < 0:
+        print("Simulations must be at least 1 and days cannot be negative.")
+        return None
+    inputs = _simulation_inputs(symbol)
+    if inputs is None:
+        return None
+    last_close_price, avg_return, volatility = inputs
+    # Only the end prices: draw the summed daily log-returns in one shot (log-normal
+    # approximation of the compounded path) instead of storing every path
+    log_drift = np.log1p(avg_return) - 0.5 * volatility ** 2
+    log_returns = np.random.default_rng().normal(log_drift * days, volatility * np.sqrt(days), simulations)
+    return last_close_price * np.exp(log_returns)
 
 def compute_risk_metrics(final_prices, risk_free_rate=0.01):
-    sorted_prices = sorted(final_prices)
-    index_5 = int(0.05 * len(sorted_prices))
-    var_95 = sorted_prices[index_5]
-    expected_return = sum(final_prices) / len(final_prices)
-    volatility = math.sqrt(sum((x - expected_return) ** 2 for x in final_prices) / len(final_prices))
+    final_prices = np.asarray(final_prices, dtype=np.float64)
+    var_95 = np.quantile(final_prices, 0.05, method="lower")
+    expected_return = final_prices.mean()
+    volatility = final_prices.std()
     sharpe_ratio = (expected_return - risk_free_rate) / volatility if volatility != 0 else 0
     return var_95, expected_return, sharpe_ratio
 
@@ -182,16 +311,31 @@ class SimulationFrame(tk.Frame):
             simulations = int(self.sim_entry.get())
         except:
             simulations = 1000
-        sim_paths = monte_carlo_simulation(symbol, days, simulations)
-        if not sim_paths:
+        # Simulate on a worker thread so the window stays responsive
+        threading.Thread(target=self._simulate, args=(symbol, days, simulations), daemon=True).start()
+
+    def _simulate(self, symbol, days, simulations):
+        try:
+            sim_paths = monte_carlo_simulation(symbol, days, simulations)
+        except Exception as e:
+            self.after(0, messagebox.showerror, "Error", f"Simulation failed: {e}")
+            return
+        # Tk widgets are only touched on the main thread
+        self.after(0, self.show_simulation, symbol, sim_paths)
+
+    def show_simulation(self, symbol, sim_paths):
+        if sim_paths is None:
             messagebox.showerror("Error", "No simulation data available. Check stock data.")
             return
         
         # Create plot using matplotlib
         fig = Figure(figsize=(6, 4), dpi=100)
         ax = fig.add_subplot(111)
-        for path in sim_paths:
-            ax.plot(path, linewidth=0.8, alpha=0.5)
+        # One collection for all paths instead of a Line2D artist per path
+        xs = np.broadcast_to(np.arange(sim_paths.shape[1]), sim_paths.shape)
+        colors = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
+        ax.add_collection(LineCollection(np.stack([xs, sim_paths], axis=-1), colors=colors, linewidths=0.8, alpha=0.5))
+        ax.autoscale()
         ax.set_title(f"Monte Carlo Simulation for {symbol}")
         ax.set_xlabel("Days")
         ax.set_ylabel("Price")
@@ -241,22 +385,39 @@ class RiskFrame(tk.Frame):
             simulations = int(self.sim_entry.get())
         except:
             simulations = 1000
-        sim_paths = monte_carlo_simulation(symbol, days, simulations)
-        if not sim_paths:
+        # Simulate and compute metrics on a worker thread so the window stays responsive
+        threading.Thread(target=self._analyze, args=(symbol, days, simulations), daemon=True).start()
+
+    def _analyze(self, symbol, days, simulations):
+        try:
+            sim_paths = monte_carlo_simulation(symbol, days, simulations)
+            metrics = None
+            if sim_paths is not None:
+                final_prices = sim_paths[:, -1].astype(np.float64)
+                var_95, expected_return, sharpe_ratio = compute_risk_metrics(final_prices)
+                metrics = (f"Expected Return: {expected_return:.2f}\n"
+                           f"VaR (95%): {var_95:.2f}\n"
+                           f"Sharpe Ratio: {sharpe_ratio:.2f}")
+        except Exception as e:
+            self.after(0, messagebox.showerror, "Error", f"Risk analysis failed: {e}")
+            return
+        # Tk widgets are only touched on the main thread
+        self.after(0, self.show_risk, symbol, sim_paths, metrics)
+
+    def show_risk(self, symbol, sim_paths, metrics):
+        if sim_paths is None:
             messagebox.showerror("Error", "No simulation data available. Check stock data.")
             return
-        final_prices = [path[-1] for path in sim_paths]
-        var_95, expected_return, sharpe_ratio = compute_risk_metrics(final_prices)
-        metrics = (f"Expected Return: {expected_return:.2f}\n"
-                   f"VaR (95%): {var_95:.2f}\n"
-                   f"Sharpe Ratio: {sharpe_ratio:.2f}")
         self.metrics_label.config(text=metrics)
         
         # Create plot using matplotlib
         fig = Figure(figsize=(6, 4), dpi=100)
         ax = fig.add_subplot(111)
-        for path in sim_paths:
-            ax.plot(path, linewidth=0.8, alpha=0.5)
+        # One collection for all paths instead of a Line2D artist per path
+        xs = np.broadcast_to(np.arange(sim_paths.shape[1]), sim_paths.shape)
+        colors = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
+        ax.add_collection(LineCollection(np.stack([xs, sim_paths], axis=-1), colors=colors, linewidths=0.8, alpha=0.5))
+        ax.autoscale()
         ax.set_title(f"Risk Analysis for {symbol}")
         ax.set_xlabel("Days")
         ax.set_ylabel("Price")
@@ -299,37 +460,63 @@ class PortfolioFrame(tk.Frame):
             days = int(self.days_entry.get())
         except:
             days = 30
+        quantities = {}
+        for sym in self.stocks:
+            try:
+                quantities[sym] = float(self.qty_entries[sym].get())
+            except:
+                quantities[sym] = 0
+        # Query and simulate on a worker thread so the window stays responsive
+        threading.Thread(target=self._calculate, args=(days, quantities), daemon=True).start()
+
+    def _calculate(self, days, quantities):
+        try:
+            results_text = self._portfolio_results(days, quantities)
+        except Exception as e:
+            self.after(0, messagebox.showerror, "Error", f"Portfolio calculation failed: {e}")
+            return
+        # Tk widgets are only touched on the main thread
+        self.after(0, self.show_portfolio, results_text)
+
+    def _portfolio_results(self, days, quantities):
         total_initial = 0
         total_predicted = 0
         results_text = ""
+        # Get the last close price (initial price) of every stock in one query
+        placeholders = ",".join("?" * len(self.stocks))
+        cursor = _CONN.cursor()
+        cursor.execute(f"""
+        SELECT symbol, close_price FROM stocks WHERE (symbol, date) IN
+            (SELECT symbol, MAX(date) FROM stocks WHERE symbol IN ({placeholders}) GROUP BY symbol)
+        """, self.stocks)
+        initial_prices = dict(cursor.fetchall())
+        # No paths are plotted here, so only the simulated end prices are needed
+        with ThreadPoolExecutor(max_workers=len(self.stocks)) as executor:
+            sim_futures = {sym: executor.submit(monte_carlo_final_only, sym, days, 100) for sym in self.stocks}
         for sym in self.stocks:
-            try:
-                qty = float(self.qty_entries[sym].get())
-            except:
-                qty = 0
-            conn = sqlite3.connect("portfolio.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT close_price FROM stocks WHERE symbol = ? ORDER BY date DESC LIMIT 1", (sym,))
-            row = cursor.fetchone()
-            conn.close()
-            if row is None:
+            qty = quantities[sym]
+            initial_price = initial_prices.get(sym)
+            if initial_price is None:
                 continue
-            initial_price = row[0]
-            sim_paths = monte_carlo_simulation(sym, days, simulations=100)
-            if not sim_paths:
+            final_prices = sim_futures[sym].result()
+            if final_prices is None:
                 continue
-            final_prices = [path[-1] for path in sim_paths]
-            avg_final_price = sum(final_prices) / len(final_prices)
+            avg_final_price = final_prices.mean()
             total_initial += qty * initial_price
             total_predicted += qty * avg_final_price
             results_text += f"{sym}: Qty = {qty}, Initial Price = {initial_price:.2f}, Predicted Avg = {avg_final_price:.2f}\n"
         if total_initial == 0:
-            messagebox.showerror("Error", "No valid data for portfolio calculation.")
-            return
+            return None
         overall_return = ((total_predicted - total_initial) / total_initial) * 100
         results_text += f"\nTotal Initial Value: {total_initial:.2f}\n"
         results_text += f"Predicted Portfolio Value: {total_predicted:.2f}\n"
         results_text += f"Overall Return: {overall_return:.2f}%"
+        return results_text
+
+    def show_portfolio(self, results_text):
+        if results_text is None:
+            messagebox.showerror("Error", "No valid data for portfolio calculation.")
+            return
         self.results_label.config(text=results_text)
 
 #########################################
@@ -339,7 +526,7 @@ class PortfolioFrame(tk.Frame):
 if __name__ == "__main__":
     create_database()
     # Fetch sample data for these stocks if not already in DB.
-    for sym in ["AAPL", "GOOGL", "MSFT"]:
-        fetch_stock_data(sym)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(fetch_stock_data, ["AAPL", "GOOGL", "MSFT"]))
     app = FinancialOptimizerApp()
     app.mainloop()